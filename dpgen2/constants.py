@@ -12,6 +12,8 @@ plm_input_name = "input.plumed"
 plm_output_name = "output.plumed"
 lmp_traj_name = "traj.dump"
 lmp_log_name = "log.lammps"
+lmp_stdout_name = "lmp.out"
+lmp_stderr_name = "lmp.err"
 lmp_model_devi_name = "model_devi.out"
 fp_index_pattern = "%06d"
 fp_task_pattern = "task." + fp_index_pattern
@@ -123,17 +123,20 @@ class LmpTemplateTaskGroup(ConfSamplingTaskGroup):
 
 
 def find_only_one_key(lmp_lines, key):
-    found = []
-    for idx in range(len(lmp_lines)):
-        words = lmp_lines[idx].split()
-        nkey = len(key)
-        if len(words) >= nkey and words[:nkey] == key:
-            found.append(idx)
-    if len(found) > 1:
-        raise RuntimeError("found %d keywords %s" % (len(found), key))
-    if len(found) == 0:
+    found = -1
+    nkey = len(key)
+    for idx, line in enumerate(lmp_lines):
+        # cheap prefilter, only split the lines that may start with the key
+        if not line.lstrip().startswith(key[0]):
+            continue
+        words = line.split(None, nkey)
+        if words[:nkey] == key:
+            if found != -1:
+                raise RuntimeError("found more than one keyword %s" % (key))
+            found = idx
+    if found == -1:
         raise RuntimeError("failed to find keyword %s" % (key))
-    return found[0]
+    return found
 
 
 def revise_lmp_input_model(lmp_lines, task_model_list, trj_freq, deepmd_version="1"):
@@ -3,6 +3,7 @@ import logging
 import os
 import random
 import re
+import shlex
 from pathlib import (
     Path,
 )
@@ -11,6 +12,7 @@ from typing import (
     Optional,
     Set,
     Tuple,
+    Union,
 )
 
 from dargs import (
@@ -34,6 +36,8 @@ from dpgen2.constants import (
     lmp_input_name,
     lmp_log_name,
     lmp_model_devi_name,
+    lmp_stderr_name,
+    lmp_stdout_name,
     lmp_traj_name,
     model_name_match_pattern,
     model_name_pattern,
@@ -41,12 +45,16 @@ from dpgen2.constants import (
 )
 from dpgen2.utils import (
     BinaryFileInput,
-    set_directory,
 )
 from dpgen2.utils.run_command import (
     run_command,
 )
 
+_model_name_match_re = re.compile(model_name_match_pattern)
+_pair_style_deepmd_re = re.compile(
+    r"^[^\S\n]*pair_style[^\S\n]+deepmd(?:[^\S\n].*)?$", re.MULTILINE
+)
+
 
 class RunLmp(OP):
     r"""Execute a LAMMPS task.
@@ -116,69 +124,119 @@ class RunLmp(OP):
         command = config["command"]
         teacher_model: Optional[BinaryFileInput] = config["teacher_model_path"]
         shuffle_models: Optional[bool] = config["shuffle_models"]
+        direct_exec: bool = config["direct_exec"]
         task_name = ip["task_name"]
         task_path = ip["task_path"]
         models = ip["models"]
         # input_files = [lmp_conf_name, lmp_input_name]
         # input_files = [(Path(task_path) / ii).resolve() for ii in input_files]
-        input_files = [ii.resolve() for ii in Path(task_path).iterdir()]
-        model_files = [Path(ii).resolve() for ii in models]
+        with os.scandir(task_path) as it:
+            input_files = [Path(ii.path) for ii in it]
+        model_files = list(models)
         work_dir = Path(task_name)
+        work_dir.mkdir(parents=True, exist_ok=True)
 
         if teacher_model is not None:
             assert (
                 len(model_files) == 1
             ), "One model is enough in knowledge distillation"
-            teacher_model.save_as_file("teacher_model.pb")
-            model_files = [Path("teacher_model.pb").resolve()] + model_files
-
-        with set_directory(work_dir):
-            # link input files
-            for ii in input_files:
-                iname = ii.name
-                Path(iname).symlink_to(ii)
-            # link models
-            for idx, mm in enumerate(model_files):
-                mname = model_name_pattern % (idx)
-                Path(mname).symlink_to(mm)
-
-            if teacher_model is not None:
-                add_teacher_model(lmp_input_name)
-
-            if shuffle_models:
-                randomly_shuffle_models(lmp_input_name)
-
-            # run lmp
+            # saved in the work dir, the tasks in one process do not share it
+            teacher_model.save_as_file(work_dir / "teacher_model.pb")
+            model_files = [work_dir / "teacher_model.pb"] + model_files
+
+        # input files and models to be linked, as (target, link name)
+        links = [(ii, ii.name) for ii in input_files]
+        links += [(mm, model_name_pattern % idx) for idx, mm in enumerate(model_files)]
+
+        # link relative to the work dir, so the task dir can be relocated
+        # together with its inputs. the relative path is computed from the
+        # real paths, as `..` after a symlinked dir is not lexical
+        real_work_dir = os.path.realpath(work_dir)
+        work_dir_fd = os.open(work_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for target, name in links:
+                os.symlink(
+                    os.path.relpath(os.path.realpath(target), real_work_dir),
+                    name,
+                    dir_fd=work_dir_fd,
+                )
+        finally:
+            os.close(work_dir_fd)
+
+        if teacher_model is not None or shuffle_models:
+            rewrite_pair_style(
+                work_dir / lmp_input_name,
+                add_teacher=teacher_model is not None,
+                shuffle=bool(shuffle_models),
+            )
+
+        # run lmp, in the work dir without changing the cwd of the process,
+        # so that several tasks may run in one process concurrently
+        if direct_exec:
+            command = shlex.split(command) + [
+                "-i",
+                lmp_input_name,
+                "-log",
+                lmp_log_name,
+            ]
+            command_str = " ".join(shlex.quote(ii) for ii in command)
+        else:
             command = " ".join([command, "-i", lmp_input_name, "-log", lmp_log_name])
-            ret, out, err = run_command(command, shell=True)
-            if ret != 0:
+            command_str = command
+        # stream the output to files, LAMMPS may run for hours
+        with open(work_dir / lmp_stdout_name, "wb") as fout, open(
+            work_dir / lmp_stderr_name, "wb"
+        ) as ferr:
+            try:
+                ret, _, _ = run_command(
+                    command,
+                    shell=not direct_exec,
+                    stdout=fout,
+                    stderr=ferr,
+                    cwd=work_dir,
+                )
+            except OSError as e:
                 logging.error(
                     "".join(
                         (
-                            "lmp failed\n",
+                            "lmp failed to start\n",
                             "command was: ",
-                            command,
-                            "out msg: ",
-                            out,
+                            command_str,
                             "\n",
-                            "err msg: ",
-                            err,
+                            "error: ",
+                            str(e),
                             "\n",
                         )
                     )
                 )
-                raise TransientError("lmp failed")
+                raise FatalError("lmp failed to start") from e
+        if ret != 0:
+            out = read_file_tail(work_dir / lmp_stdout_name)
+            err = read_file_tail(work_dir / lmp_stderr_name)
+            logging.error(
+                "".join(
+                    (
+                        "lmp failed\n",
+                        "command was: ",
+                        command_str,
+                        "out msg: ",
+                        out,
+                        "\n",
+                        "err msg: ",
+                        err,
+                        "\n",
+                    )
+                )
+            )
+            raise TransientError("lmp failed")
 
         ret_dict = {
             "log": work_dir / lmp_log_name,
             "traj": work_dir / lmp_traj_name,
             "model_devi": work_dir / lmp_model_devi_name,
         }
-        plm_output = (
-            {"plm_output": work_dir / plm_output_name}
-            if (work_dir / plm_output_name).is_file()
-            else {}
-        )
+        plm_path = os.path.join(task_name, plm_output_name)
+        plm_output = {"plm_output": Path(plm_path)} if os.path.isfile(plm_path) else {}
         ret_dict.update(plm_output)
 
         return OPIO(ret_dict)
@@ -188,6 +246,10 @@ class RunLmp(OP):
         doc_lmp_cmd = "The command of LAMMPS"
         doc_teacher_model = "The teacher model in `Knowledge Distillation`"
         doc_shuffle_models = "Randomly pick a model from the group of models to drive theexploration MD simulation"
+        doc_direct_exec = (
+            "Execute the LAMMPS command directly from its arguments instead of by a login shell. "
+            "Shell syntax is not supported and the environment set up by the shell profile, e.g. `module load`, is not loaded"
+        )
         return [
             Argument("command", str, optional=True, default="lmp", doc=doc_lmp_cmd),
             Argument(
@@ -204,86 +266,117 @@ class RunLmp(OP):
                 default=False,
                 doc=doc_shuffle_models,
             ),
+            Argument(
+                "direct_exec",
+                bool,
+                optional=True,
+                default=False,
+                doc=doc_direct_exec,
+            ),
         ]
 
     @staticmethod
     def normalize_config(data={}):
-        ta = RunLmp.lmp_args()
-        base = Argument("base", dict, ta)
-        data = base.normalize_value(data, trim_pattern="_*")
-        base.check_value(data, strict=True)
+        data = _lmp_config_base.normalize_value(data, trim_pattern="_*")
+        _lmp_config_base.check_value(data, strict=True)
         return data
 
 
 config_args = RunLmp.lmp_args
+# the config schema is static, build it once rather than per task
+_lmp_config_base = Argument("base", dict, RunLmp.lmp_args())
+
+
+def rewrite_pair_style(
+    lmp_input_name: Union[str, Path],
+    add_teacher: bool = False,
+    shuffle: bool = False,
+):
+    """Revise the `pair_style deepmd` line of the LAMMPS input in a single
+    read-modify-write pass. The teacher model is added before the models
+    are shuffled. If the input is a symbolic link, the link is replaced
+    by a regular file, so the linked source is never modified.
+    """
+    lmp_input_name = Path(lmp_input_name)
+    lmp_input = lmp_input_name.read_text(encoding="utf8")
+    match = find_pair_style_deepmd(lmp_input)
+    old_line = line = match.group()
+    if add_teacher:
+        line = add_teacher_model_to_line(line)
+    if shuffle:
+        line = shuffle_models_in_line(line)
+    if line == old_line:
+        return
+    if lmp_input_name.is_symlink():
+        lmp_input_name.unlink()
+    lmp_input_name.write_text(
+        lmp_input[: match.start()] + line + lmp_input[match.end() :], encoding="utf8"
+    )
 
 
 def add_teacher_model(lmp_input_name: str):
-    with open(lmp_input_name, encoding="utf8") as f:
-        lmp_input_lines = f.readlines()
+    rewrite_pair_style(lmp_input_name, add_teacher=True)
+
 
-    idx = find_only_one_key(lmp_input_lines, ["pair_style", "deepmd"])
+def randomly_shuffle_models(lmp_input_name: str):
+    rewrite_pair_style(lmp_input_name, shuffle=True)
 
+
+def add_teacher_model_to_line(line: str) -> str:
     model0_pattern = model_name_pattern % 0
     assert (
-        lmp_input_lines[idx].find(model0_pattern) != -1
-    ), f'Error: cannot find "{model0_pattern}" in lmp_input, {lmp_input_lines[idx]}'
+        line.find(model0_pattern) != -1
+    ), f'Error: cannot find "{model0_pattern}" in lmp_input, {line}'
 
-    lmp_input_lines[idx] = lmp_input_lines[idx].replace(
+    return line.replace(
         model0_pattern, " ".join([model_name_pattern % i for i in range(2)])
     )
 
-    with open(lmp_input_name, "w", encoding="utf8") as f:
-        f.write("".join(lmp_input_lines))
-
 
-def randomly_shuffle_models(lmp_input_name: str):
-    with open(lmp_input_name, encoding="utf8") as f:
-        lmp_input_lines = f.readlines()
-
-    idx = find_only_one_key(lmp_input_lines, ["pair_style", "deepmd"])
-    new_line_split = lmp_input_lines[idx].split()
+def shuffle_models_in_line(line: str) -> str:
+    new_line_split = line.split()
     match_first = -1
     match_last = -1
     pattern = model_name_match_pattern
     for sidx, ii in enumerate(new_line_split):
-        if re.fullmatch(pattern, ii) is not None:
-            if match_first == -1:
+        matched = _model_name_match_re.fullmatch(ii) is not None
+        if match_first == -1:
+            if matched:
                 match_first = sidx
-        else:
-            if match_first != -1:
+        elif match_last == -1:
+            if not matched:
                 match_last = sidx
-                break
+        elif matched:
+            raise RuntimeError(
+                f"unexpected matching of model pattern {pattern} " f"in line {line}"
+            )
     if match_first == -1:
-        raise RuntimeError(
-            f"cannot file model pattern {pattern} in line " f" {lmp_input_lines[idx]}"
-        )
+        raise RuntimeError(f"cannot file model pattern {pattern} in line " f" {line}")
     if match_last == -1:
         raise RuntimeError(f"last matching index should not be -1, terribly wrong ")
-    for ii in range(match_last, len(new_line_split)):
-        if re.fullmatch(pattern, new_line_split[ii]) is not None:
-            raise RuntimeError(
-                f"unexpected matching of model pattern {pattern} "
-                f"in line {lmp_input_lines[idx]}"
-            )
-    tmp = new_line_split[match_first:match_last]
-    random.shuffle(tmp)
-    new_line_split[match_first:match_last] = tmp
-    lmp_input_lines[idx] = " ".join(new_line_split)
-
-    with open(lmp_input_name, "w", encoding="utf8") as f:
-        f.write("".join(lmp_input_lines))
-
-
-def find_only_one_key(lmp_lines, key):
-    found = []
-    for idx in range(len(lmp_lines)):
-        words = lmp_lines[idx].split()
-        nkey = len(key)
-        if len(words) >= nkey and words[:nkey] == key:
-            found.append(idx)
+    if match_last - match_first <= 1:
+        # only one model, nothing to shuffle
+        return line
+    # Fisher-Yates shuffle of the model names in place
+    for ii in range(match_last - 1, match_first, -1):
+        jj = random.randint(match_first, ii)
+        new_line_split[ii], new_line_split[jj] = new_line_split[jj], new_line_split[ii]
+    return " ".join(new_line_split)
+
+
+def read_file_tail(fname: Union[str, Path], size: int = 8192) -> str:
+    with open(fname, "rb") as f:
+        f.seek(max(os.fstat(f.fileno()).st_size - size, 0))
+        return f.read().decode(errors="replace")
+
+
+def find_pair_style_deepmd(lmp_input: str):
+    """Find the only `pair_style deepmd` line in the LAMMPS input. The
+    match spans the line without its line break.
+    """
+    found = list(_pair_style_deepmd_re.finditer(lmp_input))
     if len(found) > 1:
-        raise RuntimeError("found %d keywords %s" % (len(found), key))
+        raise RuntimeError("found %d pair_style deepmd lines" % len(found))
     if len(found) == 0:
-        raise RuntimeError("failed to find keyword %s" % (key))
+        raise RuntimeError("failed to find a pair_style deepmd line")
     return found[0]
@@ -1,6 +1,14 @@
 import os
+import shlex
+import shutil
+import subprocess
+from pathlib import (
+    Path,
+)
 from typing import (
+    IO,
     List,
+    Optional,
     Tuple,
     Union,
 )
@@ -14,8 +22,33 @@ from dflow.utils import run_command as dflow_run_command
 def run_command(
     cmd: Union[str, List[str]],
     shell: bool = False,
+    stdout: Optional[IO] = None,
+    stderr: Optional[IO] = None,
+    cwd: Optional[Union[str, Path]] = None,
 ) -> Tuple[int, str, str]:
+    """Run a command and return its return code, stdout and stderr."""
+    if stdout is not None or stderr is not None:
+        if shell:
+            # run by bash as dflow does, falling back to sh
+            if isinstance(cmd, list):
+                cmd = " ".join(cmd)
+            if shutil.which("bash") is not None:
+                interactive = False if config["mode"] == "debug" else True
+                cmd = ["bash", "-lc" if interactive else "-c", cmd]
+            else:
+                cmd = ["sh", "-c", cmd]
+        elif isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        ret = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE if stdout is None else stdout,
+            stderr=subprocess.PIPE if stderr is None else stderr,
+            cwd=cwd,
+        )
+        out = ret.stdout.decode() if stdout is None else ""
+        err = ret.stderr.decode() if stderr is None else ""
+        return ret.returncode, out, err
     interactive = False if config["mode"] == "debug" else True
     return dflow_run_command(
-        cmd, raise_error=False, try_bash=shell, interactive=interactive
+        cmd, raise_error=False, try_bash=shell, interactive=interactive, cwd=cwd
     )
@@ -33,6 +33,9 @@ from dpgen2.exploration.task import (
     ExplorationStage,
     LmpTemplateTaskGroup,
 )
+from dpgen2.exploration.task.lmp_template_task_group import (
+    find_only_one_key,
+)
 
 in_lmp_template = textwrap.dedent(
     """variable        NSTEPS          equal V_NSTEPS
@@ -333,3 +336,36 @@ class TestLmpTemplateTaskGroup(unittest.TestCase):
                 ee,
             )
             idx += 1
+
+
+class TestFindOnlyOneKey(unittest.TestCase):
+    def test_found(self):
+        lmp_lines = [
+            "units           metal",
+            "pair_stylefoo   deepmd model.000.pb",
+            "  pair_style    deepmd model.000.pb",
+            "pair_coeff      * *",
+        ]
+        self.assertEqual(find_only_one_key(lmp_lines, ["pair_style", "deepmd"]), 2)
+
+    def test_key_only(self):
+        lmp_lines = ["units           metal", "pair_style deepmd"]
+        self.assertEqual(find_only_one_key(lmp_lines, ["pair_style", "deepmd"]), 1)
+
+    def test_not_found(self):
+        lmp_lines = [
+            "pair_stylefoo   deepmd model.000.pb",
+            "pair_style      deepmdfoo model.000.pb",
+            "pair_style",
+        ]
+        with self.assertRaisesRegex(RuntimeError, "failed to find keyword"):
+            find_only_one_key(lmp_lines, ["pair_style", "deepmd"])
+
+    def test_duplicate(self):
+        lmp_lines = [
+            "pair_style      deepmd model.000.pb",
+            "pair_coeff      * *",
+            "   pair_style   deepmd model.001.pb",
+        ]
+        with self.assertRaisesRegex(RuntimeError, "found more than one keyword"):
+            find_only_one_key(lmp_lines, ["pair_style", "deepmd"])
@@ -2,6 +2,9 @@ import json
 import os
 import shutil
 import unittest
+from concurrent.futures import (
+    ThreadPoolExecutor,
+)
 from pathlib import (
     Path,
 )
@@ -11,6 +14,7 @@ from dflow.python import (
     OP,
     OPIO,
     Artifact,
+    FatalError,
     OPIOSign,
     TransientError,
 )
@@ -29,6 +33,8 @@ from dpgen2.constants import (
     lmp_input_name,
     lmp_log_name,
     lmp_model_devi_name,
+    lmp_stderr_name,
+    lmp_stdout_name,
     lmp_traj_name,
     model_name_pattern,
 )
@@ -88,26 +94,106 @@ class TestRunLmp(unittest.TestCase):
             call(
                 " ".join(["mylmp", "-i", lmp_input_name, "-log", lmp_log_name]),
                 shell=True,
+                stdout=mock.ANY,
+                stderr=mock.ANY,
+                cwd=Path(self.task_name),
             ),
         ]
         mocked_run.assert_has_calls(calls)
         # check input files are correctly linked
         self.assertEqual((work_dir / lmp_conf_name).read_text(), "foo")
         self.assertEqual((work_dir / lmp_input_name).read_text(), "bar")
+        # check the links are relative to the work dir
+        self.assertEqual(
+            os.readlink(work_dir / lmp_conf_name),
+            os.path.join("..", "task", "path", lmp_conf_name),
+        )
+        self.assertEqual(
+            os.readlink(work_dir / (model_name_pattern % 0)),
+            os.path.join("..", "models", "path", "model_0.pb"),
+        )
         for ii in range(4):
             self.assertEqual(
                 (work_dir / (model_name_pattern % ii)).read_text(), f"model{ii}"
             )
 
+    @patch("dpgen2.op.run_lmp.run_command")
+    def test_success_symlinked_model_dir(self, mocked_run):
+        mocked_run.side_effect = [(0, "foo\n", "")]
+        # models/link/.. is models/real, not models
+        (self.model_path.parent / "real" / "sub").mkdir(parents=True)
+        (self.model_path.parent / "link").symlink_to(Path("real", "sub"))
+        (self.model_path.parent / "real" / "model.pb").write_text("real model")
+        model = self.model_path.parent / "link" / ".." / "model.pb"
+        op = RunLmp()
+        out = op.execute(
+            OPIO(
+                {
+                    "config": {"command": "mylmp"},
+                    "task_name": self.task_name,
+                    "task_path": self.task_path,
+                    "models": [model],
+                }
+            )
+        )
+        work_dir = Path(self.task_name)
+        self.assertEqual(
+            os.readlink(work_dir / (model_name_pattern % 0)),
+            os.path.join("..", "models", "real", "model.pb"),
+        )
+        self.assertEqual(
+            (work_dir / (model_name_pattern % 0)).read_text(), "real model"
+        )
+
+    @patch("dpgen2.op.run_lmp.run_command")
+    def test_success_direct_exec(self, mocked_run):
+        mocked_run.side_effect = [(0, "foo\n", "")]
+        op = RunLmp()
+        out = op.execute(
+            OPIO(
+                {
+                    "config": {
+                        "command": "mylmp -var name 'a b'",
+                        "direct_exec": True,
+                    },
+                    "task_name": self.task_name,
+                    "task_path": self.task_path,
+                    "models": self.models,
+                }
+            )
+        )
+        # check call
+        calls = [
+            call(
+                [
+                    "mylmp",
+                    "-var",
+                    "name",
+                    "a b",
+                    "-i",
+                    lmp_input_name,
+                    "-log",
+                    lmp_log_name,
+                ],
+                shell=False,
+                stdout=mock.ANY,
+                stderr=mock.ANY,
+                cwd=Path(self.task_name),
+            ),
+        ]
+        mocked_run.assert_has_calls(calls)
+
     @patch("dpgen2.op.run_lmp.run_command")
     def test_error(self, mocked_run):
         mocked_run.side_effect = [(1, "foo\n", "")]
         op = RunLmp()
-        with self.assertRaises(TransientError) as ee:
+        with self.assertRaises(TransientError) as ee, self.assertLogs(
+            level="ERROR"
+        ) as logs:
             out = op.execute(
                 OPIO(
                     {
-                        "config": {"command": "mylmp"},
+                        "config": {"command": "mylmp -var name 'a b'"},
                         "task_name": self.task_name,
                         "task_path": self.task_path,
                         "models": self.models,
@@ -117,11 +203,82 @@ class TestRunLmp(unittest.TestCase):
         # check call
         calls = [
             call(
-                " ".join(["mylmp", "-i", lmp_input_name, "-log", lmp_log_name]),
+                " ".join(
+                    [
+                        "mylmp -var name 'a b'",
+                        "-i",
+                        lmp_input_name,
+                        "-log",
+                        lmp_log_name,
+                    ]
+                ),
                 shell=True,
+                stdout=mock.ANY,
+                stderr=mock.ANY,
+                cwd=Path(self.task_name),
             ),
         ]
         mocked_run.assert_has_calls(calls)
+        # the logged command keeps its quoting
+        self.assertIn(
+            f"command was: mylmp -var name 'a b' -i {lmp_input_name} -log {lmp_log_name}",
+            logs.output[0],
+        )
+
+    def test_error_no_command(self):
+        op = RunLmp()
+        with self.assertRaises(FatalError) as ee, self.assertLogs(
+            level="ERROR"
+        ) as logs:
+            out = op.execute(
+                OPIO(
+                    {
+                        "config": {
+                            "command": "no_such_lmp_binary",
+                            "direct_exec": True,
+                        },
+                        "task_name": self.task_name,
+                        "task_path": self.task_path,
+                        "models": self.models,
+                    }
+                )
+            )
+        self.assertIn(
+            f"command was: no_such_lmp_binary -i {lmp_input_name} -log {lmp_log_name}",
+            logs.output[0],
+        )
+
+    @patch("dpgen2.op.run_lmp.run_command")
+    def test_error_output(self, mocked_run):
+        def fake_run(cmd, shell=False, stdout=None, stderr=None, cwd=None):
+            stdout.write(b"x" * 10000 + b"lmp out tail")
+            stderr.write(b"lmp err msg")
+            return (1, "", "")
+
+        mocked_run.side_effect = fake_run
+        op = RunLmp()
+        with self.assertRaises(TransientError) as ee, self.assertLogs(
+            level="ERROR"
+        ) as logs:
+            out = op.execute(
+                OPIO(
+                    {
+                        "config": {"command": "mylmp"},
+                        "task_name": self.task_name,
+                        "task_path": self.task_path,
+                        "models": self.models,
+                    }
+                )
+            )
+        # the output is streamed to files, and only their tails are logged
+        work_dir = Path(self.task_name)
+        self.assertEqual(
+            (work_dir / lmp_stdout_name).read_bytes(), b"x" * 10000 + b"lmp out tail"
+        )
+        self.assertEqual((work_dir / lmp_stderr_name).read_text(), "lmp err msg")
+        self.assertIn("x" * 100 + "lmp out tail", logs.output[0])
+        self.assertNotIn("x" * 8192, logs.output[0])
+        self.assertIn("err msg: lmp err msg", logs.output[0])
 
 
 class TestRunLmpDist(unittest.TestCase):
@@ -209,6 +366,11 @@ run             3000 upto
             "model.000.pb", "model.000.pb model.001.pb"
         )
         self.assertEqual((work_dir / lmp_input_name).read_text(), lmp_config)
+        # the revised input is a copy, the source input is untouched
+        self.assertFalse((work_dir / lmp_input_name).is_symlink())
+        self.assertEqual(
+            (self.task_path / lmp_input_name).read_text(), TestRunLmpDist.lmp_config
+        )
 
         # check if the teacher model is linked to model.000.pb
         ii = 0
@@ -222,13 +384,81 @@ run             3000 upto
         )
 
         # The number of models have to be 2 in knowledge distillation
-        self.assertEqual(len(list((work_dir.glob("*.pb")))), 2)
+        self.assertEqual(len(list((work_dir.glob("model.*.pb")))), 2)
+
+    @patch("dpgen2.op.run_lmp.run_command")
+    def test_success_two_tasks(self, mocked_run):
+        mocked_run.return_value = (0, "", "")
+        (self.teacher_path / "teacher_1.pb").write_text("teacher model 1")
+        teacher_models = [
+            self.teacher_model,
+            BinaryFileInput(self.teacher_path / "teacher_1.pb", "pb"),
+        ]
+        task_names = [self.task_name, "task_001"]
+        self.addCleanup(shutil.rmtree, task_names[1], ignore_errors=True)
+
+        def run_task(ii):
+            return RunLmp().execute(
+                OPIO(
+                    {
+                        "config": {
+                            "command": "mylmp",
+                            "teacher_model_path": teacher_models[ii],
+                        },
+                        "task_name": task_names[ii],
+                        "task_path": self.task_path,
+                        "models": self.models,
+                    }
+                )
+            )
+
+        # run two tasks concurrently in one process
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(run_task, range(2)))
+
+        # each task saves and links its own teacher model
+        for ii, tt in enumerate(["teacher model", "teacher model 1"]):
+            work_dir = Path(task_names[ii])
+            self.assertEqual((work_dir / "teacher_model.pb").read_text(), tt)
+            self.assertEqual(
+                os.readlink(work_dir / (model_name_pattern % 0)), "teacher_model.pb"
+            )
+            self.assertEqual((work_dir / (model_name_pattern % 0)).read_text(), tt)
+        self.assertFalse(Path("teacher_model.pb").exists())
+
+    @patch("dpgen2.op.run_lmp.random.randint")
+    @patch("dpgen2.op.run_lmp.run_command")
+    def test_success_shuffle(self, mocked_run, mock_randint):
+        mocked_run.side_effect = [(0, "foo\n", "")]
+        mock_randint.side_effect = pick_first
+        op = RunLmp()
+        out = op.execute(
+            OPIO(
+                {
+                    "config": {
+                        "command": "mylmp",
+                        "teacher_model_path": self.teacher_model,
+                        "shuffle_models": True,
+                    },
+                    "task_name": self.task_name,
+                    "task_path": self.task_path,
+                    "models": self.models,
+                }
+            )
+        )
+        work_dir = Path(self.task_name)
+
+        # the teacher model is added before the models are shuffled
+        lmp_config = TestRunLmpDist.lmp_config.replace(
+            "pair_style      deepmd model.000.pb",
+            "pair_style deepmd model.001.pb model.000.pb",
+        )
+        self.assertEqual((work_dir / lmp_input_name).read_text(), lmp_config)
+        mock_randint.assert_called_once()
 
 
-def swap_element(arg):
-    bk = arg.copy()
-    arg[1] = bk[0]
-    arg[0] = bk[1]
+def pick_first(a, b):
+    return a
 
 
 class TestRandomShuffleModels(unittest.TestCase):
@@ -238,9 +468,9 @@ class TestRandomShuffleModels(unittest.TestCase):
     def tearDown(self):
         os.remove(self.input_name)
 
-    @patch("dpgen2.op.run_lmp.random.shuffle")
-    def test(self, mock_shuffle):
-        mock_shuffle.side_effect = swap_element
+    @patch("dpgen2.op.run_lmp.random.randint")
+    def test(self, mock_randint):
+        mock_randint.side_effect = pick_first
         lmp_config = "pair_style      deepmd model.000.pb model.001.pb out_freq 10 out_file model_devi.out"
         expected_output = "pair_style deepmd model.001.pb model.000.pb out_freq 10 out_file model_devi.out"
         input_name = self.input_name
@@ -248,6 +478,35 @@ class TestRandomShuffleModels(unittest.TestCase):
         randomly_shuffle_models(input_name)
         self.assertEqual(input_name.read_text(), expected_output)
 
+    @patch("dpgen2.op.run_lmp.random.randint")
+    def test_other_lines(self, mock_randint):
+        mock_randint.side_effect = pick_first
+        lmp_config = (
+            "# model.000.pb drives the md\n"
+            "pair_style      deepmd model.000.pb model.001.pb out_freq 10 out_file model_devi.out\n"
+            "pair_coeff      * *\n"
+        )
+        expected_output = (
+            "# model.000.pb drives the md\n"
+            "pair_style deepmd model.001.pb model.000.pb out_freq 10 out_file model_devi.out\n"
+            "pair_coeff      * *\n"
+        )
+        input_name = self.input_name
+        input_name.write_text(lmp_config)
+        randomly_shuffle_models(input_name)
+        self.assertEqual(input_name.read_text(), expected_output)
+
+    @patch("dpgen2.op.run_lmp.random.randint")
+    def test_one_model(self, mock_randint):
+        lmp_config = (
+            "pair_style      deepmd model.000.pb out_freq 10 out_file model_devi.out"
+        )
+        input_name = self.input_name
+        input_name.write_text(lmp_config)
+        randomly_shuffle_models(input_name)
+        self.assertEqual(input_name.read_text(), lmp_config)
+        mock_randint.assert_not_called()
+
     def test_failed(self):
         lmp_config = "pair_style      deepmd model.000.pb model.001.pb out_freq 10 out_file model_devi.out model.002.pb"
         input_name = self.input_name
@@ -263,3 +522,20 @@ class TestRandomShuffleModels(unittest.TestCase):
         input_name.write_text(lmp_config)
         with self.assertRaises(RuntimeError) as re:
             randomly_shuffle_models(input_name)
+
+    def test_failed_two_pair_style(self):
+        lmp_config = (
+            "pair_style      deepmd model.000.pb model.001.pb out_freq 10\n"
+            "pair_style      deepmd model.000.pb model.001.pb out_freq 10\n"
+        )
+        input_name = self.input_name
+        input_name.write_text(lmp_config)
+        with self.assertRaisesRegex(RuntimeError, "found 2 pair_style deepmd lines"):
+            randomly_shuffle_models(input_name)
+
+    def test_failed_no_pair_style(self):
+        lmp_config = "pair_style      deepmdfoo model.000.pb model.001.pb out_freq 10\n"
+        input_name = self.input_name
+        input_name.write_text(lmp_config)
+        with self.assertRaisesRegex(RuntimeError, "failed to find"):
+            randomly_shuffle_models(input_name)
@@ -63,3 +63,32 @@ class TestRunCommand(unittest.TestCase):
         # self.assertEqual(err, "ls: cannot access 'tar': No such file or directory\n")
         self.assertNotEqual(err, "")
         os.chdir("..")
+
+    def test_redirect(self):
+        os.chdir(self.work_path)
+        with open("out", "wb") as fout:
+            ret, out, err = run_command(["ls", "foo", "tar"], stdout=fout)
+        self.assertNotEqual(ret, 0)
+        self.assertEqual(out, "")
+        self.assertNotEqual(err, "")
+        self.assertEqual(Path("out").read_text(), "foo\n")
+        os.chdir("..")
+
+    def test_cwd(self):
+        ret, out, err = run_command(["ls"], cwd=self.work_path)
+        self.assertEqual(ret, 0)
+        self.assertEqual(out, "bar\nfoo\n")
+
+    def test_redirect_str(self):
+        with open(self.work_path / "out", "wb") as fout:
+            ret, out, err = run_command("ls 'foo' bar", stdout=fout, cwd=self.work_path)
+        self.assertEqual(ret, 0)
+        self.assertEqual((self.work_path / "out").read_text(), "bar\nfoo\n")
+
+    def test_redirect_shell(self):
+        with open(self.work_path / "out", "wb") as fout:
+            ret, out, err = run_command(
+                ["ls | sort -r"], shell=True, stdout=fout, cwd=self.work_path
+            )
+        self.assertEqual(ret, 0)
+        self.assertEqual((self.work_path / "out").read_text(), "out\nfoo\nbar\n")